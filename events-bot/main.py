@@ -2,21 +2,26 @@
 
 import argparse
 import html
+import itertools
 import os
 import sys
 
 from collections import defaultdict
-from datetime import datetime, timedelta
-from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from zoneinfo import ZoneInfo
 
+import ijson
 import jinja2
-import pytz
 import markdownify
 import requests
 import zulip
 
 
 TIMEOUT = 5
+MAX_WORKERS = 8
 
 PLAN_IT_PURPLE_FEED_ID = 2103
 
@@ -35,9 +40,23 @@ STREAM_CALENDAR_IDS: dict[str, list[int]] = {
 
 TOPIC = "events"
 
+# Reverse index so that grouping events is a single pass with one dict lookup per
+# event. A calendar can feed several streams (e.g. 4559 -> health, labor, public).
+_CALENDAR_STREAMS: dict[int, list[str]] = {}
+for _stream, _calendar_ids in STREAM_CALENDAR_IDS.items():
+    for _calendar_id in _calendar_ids:
+        _CALENDAR_STREAMS.setdefault(_calendar_id, []).append(_stream)
+
+# Templates never change at runtime, so skip auto-reload stat()s and cache the
+# compiled bytecode on disk so repeated runs skip the parse/compile step.
+_BYTECODE_CACHE_DIR = "/tmp/zulip-events-bot-jinja"
+os.makedirs(_BYTECODE_CACHE_DIR, exist_ok=True)
+
 _env = jinja2.Environment(
     loader=jinja2.FileSystemLoader(os.path.dirname(os.path.realpath(__file__))),
     autoescape=True,
+    auto_reload=False,
+    bytecode_cache=jinja2.FileSystemBytecodeCache(directory=_BYTECODE_CACHE_DIR),
 )
 
 template_daily = _env.get_template("daily.md.jinja2")
@@ -48,34 +67,51 @@ class ZulipError(Exception):
     pass
 
 
-class PlanItPurpleEvent(NamedTuple):
+@dataclass(slots=True, frozen=True)
+class PlanItPurpleEvent:
     occurrence_id: int
     calendar_id: int
     title: str
     description: Optional[str]
     start: datetime
     end: datetime
+    # The event date, precomputed so filtering and grouping need no per-event
+    # start.date() calls (each of which allocates a fresh date)
+    start_date: date
     is_all_day: bool
     is_cancelled: bool
+    url: str
 
-    @property
-    def url(self):
-        return f"https://planitpurple.northwestern.edu/event/{self.occurrence_id}"
 
-
-def get_pip_events(session: requests.Session):
-    resp = session.get(f"https://planitpurple.northwestern.edu/feed/json/{PLAN_IT_PURPLE_FEED_ID}", timeout=TIMEOUT)
+def get_pip_events(session: requests.Session) -> Iterator[PlanItPurpleEvent]:
+    # Parse the feed incrementally rather than materialising the whole JSON tree:
+    # only one raw event and its PlanItPurpleEvent are alive at a time.
+    resp = session.get(f"https://planitpurple.northwestern.edu/feed/json/{PLAN_IT_PURPLE_FEED_ID}", timeout=TIMEOUT, stream=True)
     resp.raise_for_status()
+    resp.raw.decode_content = True
 
-    raw_events = resp.json()
-    return list(_extract_pip_events(raw_events))
+    yield from _extract_pip_events(ijson.items(resp.raw, "item"))
 
 
-def _extract_pip_events(data: List[Dict[str, Any]]) -> Iterator[PlanItPurpleEvent]:
-    # https://www.northwestern.edu/web-resources/developer-resources/planitpurple-feeds/json-feeds.html
-    # Events are apparently in Central Standard Time, by which I think they mean Central Time
-    tz = pytz.timezone("America/Chicago")
+# Events are apparently in Central Standard Time, by which I think they mean Central Time
+_TZ = ZoneInfo("America/Chicago")
+
+# One converter reused for every event rather than a fresh MarkdownConverter per call
+_md = markdownify.MarkdownConverter(heading_style="ATX", bullets="-")
+
+
+def _parse_date(s: str) -> date:
+    # The feed dates are always "YYYY-MM-DD"; slicing is much faster than strptime
+    return date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+
 
+def _parse_time(s: str) -> time:
+    # The feed times are always "HH:MM:SS"
+    return time(int(s[0:2]), int(s[3:5]), int(s[6:8]))
+
+
+def _extract_pip_events(data: Iterable[Dict[str, Any]]) -> Iterator[PlanItPurpleEvent]:
+    # https://www.northwestern.edu/web-resources/developer-resources/planitpurple-feeds/json-feeds.html
     for raw_event in data:
         occurrence_id = int(raw_event["id"])
         calendar_id = int(raw_event["cal_id"])
@@ -89,17 +125,20 @@ def _extract_pip_events(data: List[Dict[str, Any]]) -> Iterator[PlanItPurpleEven
 
         title = html.unescape(raw_title)
 
-        if description_html:
-            description = markdownify.markdownify(description_html)
-        else:
+        if not description_html or not description_html.strip():
             description = None
+        elif "<" not in description_html:
+            # Already plain text; no need to build an HTML tree for it
+            description = html.unescape(description_html).strip()
+        else:
+            description = _md.convert(description_html)
 
-        event_date = datetime.strptime(raw_date, "%Y-%m-%d").date()
-        start_time = datetime.strptime(raw_start_time, "%H:%M:%S").time()
-        end_time = datetime.strptime(raw_end_time, "%H:%M:%S").time()
+        event_date = _parse_date(raw_date)
+        start_time = _parse_time(raw_start_time)
+        end_time = _parse_time(raw_end_time)
 
-        start = tz.localize(datetime.combine(event_date, start_time))
-        end = tz.localize(datetime.combine(event_date, end_time))
+        start = datetime.combine(event_date, start_time, tzinfo=_TZ)
+        end = datetime.combine(event_date, end_time, tzinfo=_TZ)
 
         yield PlanItPurpleEvent(
             occurrence_id=occurrence_id,
@@ -108,29 +147,30 @@ def _extract_pip_events(data: List[Dict[str, Any]]) -> Iterator[PlanItPurpleEven
             description=description,
             start=start,
             end=end,
+            start_date=event_date,
             is_all_day=is_all_day,
             is_cancelled=is_cancelled,
+            url=f"https://planitpurple.northwestern.edu/event/{occurrence_id}",
         )
 
 
-def _events_per_field(events: List[PlanItPurpleEvent]) -> dict[str, list[PlanItPurpleEvent]]:
+def _events_per_field(events: Iterable[PlanItPurpleEvent]) -> dict[str, list[PlanItPurpleEvent]]:
     stream_events = defaultdict(list)
 
-    for stream, calendar_ids in STREAM_CALENDAR_IDS.items():
-        for event in events:
-            if event.calendar_id in calendar_ids:
-                stream_events[stream].append(event)
+    for event in events:
+        for stream in _CALENDAR_STREAMS.get(event.calendar_id, ()):
+            stream_events[stream].append(event)
 
     return dict(stream_events)
 
 
-def make_messages(all_events: List[PlanItPurpleEvent], period: str) -> Iterator[dict[str, Any]]:
+def make_messages(all_events: Iterable[PlanItPurpleEvent], period: str) -> Iterator[dict[str, Any]]:
     today = datetime.now().date()
     sunday = today + timedelta(days=(6-today.weekday()))
 
     if period == "daily":
         def filter_events(events: List[PlanItPurpleEvent]):
-            return [event for event in events if event.start.date() == today]
+            return [event for event in events if event.start_date == today]
 
         def render_message(events: List[PlanItPurpleEvent]):
             return template_daily.render(
@@ -139,13 +179,16 @@ def make_messages(all_events: List[PlanItPurpleEvent], period: str) -> Iterator[
 
     elif period == "weekly":
         def filter_events(events: List[PlanItPurpleEvent]):
-            return [event for event in events if today <= event.start.date() <= sunday]
+            return [event for event in events if today <= event.start_date <= sunday]
 
         def render_message(events: List[PlanItPurpleEvent]):
-            # Split events into days. They are automatically sorted by PlanItPurple
-            events_by_date = defaultdict(list)
-            for event in events:
-                events_by_date[event.start.date()].append(event)
+            # Split events into days. They are automatically sorted by PlanItPurple,
+            # so one groupby pass yields (day, events) pairs already in order; the
+            # template iterates the pairs directly with no dict hashing at all
+            events_by_date = [
+                (day, list(day_events))
+                for day, day_events in itertools.groupby(events, key=lambda event: event.start_date)
+            ]
 
             return template_weekly.render(
                 events_by_date=events_by_date,
@@ -191,18 +234,23 @@ if __name__ == "__main__":
     client = zulip.Client(config_file=config_file)
 
     with requests.Session() as session:
-        events = get_pip_events(session)
-
-    messages = list(make_messages(events, args.period))
+        messages = list(make_messages(get_pip_events(session), args.period))
 
     if args.dry_run:
         for message in messages:
             print_message(message)
     else:
-        for message in messages:
-            result = client.send_message(message)
+        # Each message is an independent POST to the same host, so send them
+        # concurrently over the client's keep-alive connections
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = list(executor.map(client.send_message, messages))
 
+        failed = False
+        for message, result in zip(messages, results):
             if result["result"] != "success":
                 print(f"could not send message to {message['to']}: {result['msg']}", file=sys.stderr)
-                sys.exit(1)
+                failed = True
+
+        if failed:
+            sys.exit(1)
 
@@ -16,12 +16,11 @@
 
       pypkgs-core = forAllSystems (system:
         ps: with ps; [
-          beautifulsoup4
           feedparser
+          ijson
           jinja2
           lxml
           markdownify
-          pytz
           requests
           zulip
         ]
@@ -29,7 +28,6 @@
 
       pypkgs-dev = forAllSystems (system:
         ps: with ps; [
-          types-pytz
           types-requests
 
           pylsp-mypy
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
 import os
+import pickle
 import re
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 
@@ -10,7 +13,8 @@ import zulip
 
 import jinja2
 import requests
-from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+from lxml.etree import XPath
 
 
 @dataclass
@@ -24,6 +28,21 @@ class GradStudent:
         return self.email.endswith("@kellogg.northwestern.edu")
 
 
+@dataclass
+class StudentIndex:
+    by_email: Dict[str, GradStudent]
+    by_name: Dict[str, GradStudent]
+
+
+def index_students(students: List[GradStudent]) -> StudentIndex:
+    # Index the scraped students once so that each lookup is O(1) rather than a
+    # linear scan per member
+    return StudentIndex(
+        by_email={student.email: student for student in students},
+        by_name={student.name.lower(): student for student in students},
+    )
+
+
 FIRST_YEAR_COURSES_STREAMS = ["course/ECON 410-1", "course/ECON 411-1", "course/ECON 480-1"]
 
 STREAM_EMOJIS = {
@@ -54,45 +73,133 @@ class ZulipError(Exception):
     pass
 
 
+# Precomputed lookup tables so that matching a scraped field to a stream is a dict
+# hit or two rather than a startswith scan over every FIELD_STREAMS key
+_FIELD_EXACT = {field.lower(): stream for field, stream in FIELD_STREAMS.items()}
+_FIELD_BY_FIRST_WORD = {field.split()[0].lower(): (field, stream) for field, stream in FIELD_STREAMS.items()}
+
+
+_FIELD_SPLIT_RE = re.compile(r",|and")
+_EMAIL_YEAR_RE = re.compile(r"^([a-zA-Z]+)\d{4}@([a-z\.]+)$")
+
+# Compiled once; parsing the directory with lxml directly avoids BeautifulSoup's
+# Python-level node wrapping on hundreds of people cards
+_ARTICLES_XPATH = XPath('//*[@id="main-content"]//article[contains(concat(" ", normalize-space(@class), " "), " people ")]')
+_CONTENT_XPATH = XPath('.//*[contains(concat(" ", normalize-space(@class), " "), " people-content ")]')
+
+
+STREAMS_CACHE_TTL = 10 * 60  # seconds
+
+MAX_WORKERS = 8
+
+_streams_cache: Optional[tuple[float, List[str], List[str]]] = None
+
+
+def _get_stream_lists(client) -> tuple[List[str], List[str]]:
+    # Streams change rarely but the bot welcomes many users (and runs for a long
+    # time), so only refetch the stream list every STREAMS_CACHE_TTL seconds
+    global _streams_cache
+
+    now = time.monotonic()
+    if _streams_cache is not None and now - _streams_cache[0] < STREAMS_CACHE_TTL:
+        return _streams_cache[1], _streams_cache[2]
+
+    resp = client.get_streams()
+    if resp["result"] != "success":
+        raise ZulipError(f"cannot get streams: {resp['msg']}")
+
+    all_streams = [stream["name"] for stream in resp["streams"]]
+    course_streams = [stream for stream in all_streams if stream.startswith("course/")]
+    field_streams = [stream for stream in all_streams if stream.startswith("field/")]
+
+    _streams_cache = (now, course_streams, field_streams)
+    return course_streams, field_streams
+
+
+
+GRAD_STUDENTS_URL = "https://economics.northwestern.edu/people/graduate/index.html"
+
+_STUDENTS_CACHE = os.path.join(os.path.expanduser("~/.cache"), "zulip-welcome-bot", "students.pickle")
+
+
+def _load_cached_students() -> tuple[Optional[str], Optional[List[GradStudent]]]:
+    try:
+        with open(_STUDENTS_CACHE, "rb") as f:
+            etag, students = pickle.load(f)
+        return etag, students
+    except (OSError, pickle.PickleError, EOFError, ValueError):
+        return None, None
+
+
+def _save_cached_students(etag: Optional[str], students: List[GradStudent]):
+    if etag is None:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(_STUDENTS_CACHE), exist_ok=True)
+        with open(_STUDENTS_CACHE, "wb") as f:
+            pickle.dump((etag, students), f)
+    except OSError:
+        # The cache is only an optimisation; carry on without it
+        pass
+
 
 def scrape_grad_students() -> List[GradStudent]:
-    resp = requests.get("https://economics.northwestern.edu/people/graduate/index.html", timeout=5)
+    # Use a conditional GET so that a restart against an unchanged directory page
+    # costs a 304 response instead of a full download and re-parse
+    etag, cached = _load_cached_students()
+
+    headers = {}
+    if etag is not None and cached is not None:
+        headers["If-None-Match"] = etag
+
+    resp = requests.get(GRAD_STUDENTS_URL, timeout=5, headers=headers)
+    if resp.status_code == 304 and cached is not None:
+        return cached
     resp.raise_for_status()
-    soup = BeautifulSoup(resp.content, features="lxml")
-    students_soup = soup.select("#main-content article.people")
 
-    return [_extract_grad_student(student_soup) for student_soup in students_soup]
+    tree = lxml_html.fromstring(resp.content)
+    students = [_extract_grad_student(article) for article in _ARTICLES_XPATH(tree)]
 
+    _save_cached_students(resp.headers.get("ETag"), students)
+    return students
+
+
+def _extract_grad_student(article: lxml_html.HtmlElement) -> GradStudent:
+    _a_id, h3, p_year, p_info = _CONTENT_XPATH(article)[0]
+
+    name = h3.text_content().strip().removesuffix("(Financial Economics Student)").strip()
+    year_text = p_year.text_content()
 
-def _extract_grad_student(soup: BeautifulSoup) -> GradStudent:
-    _a_id, h3, p_year, p_info = soup.select_one(".people-content").children
-    
-    name = h3.text.strip().removesuffix("(Financial Economics Student)").strip()
-    year_text = p_year.text
-    
     if not year_text.startswith("Year"):
         raise ValueError(f"Invalid year {year_text}")
-    
+
     year = int(year_text.removeprefix("Year").strip())
-    
+
     fields = []
-    for string in p_info.stripped_strings:
+    for string in p_info.itertext():
+        string = string.strip()
         if string.startswith("Research Field:"):
-            fields = [field.strip() for field in re.split(r",|and", string.removeprefix("Research Field:"))]
-        
-        elif string.strip().endswith("@u.northwestern.edu") or string.strip().endswith("@kellogg.northwestern.edu"):
-            email = string.strip().lower()
-    
+            fields = [field.strip() for field in _FIELD_SPLIT_RE.split(string.removeprefix("Research Field:"))]
+
+        elif string.endswith("@u.northwestern.edu") or string.endswith("@kellogg.northwestern.edu"):
+            email = string.lower()
+
     return GradStudent(name=name, year=year, email=email, fields=fields)
 
 def _website_field_to_stream(field):
-    if field in FIELD_STREAMS:
-        return "field/" + FIELD_STREAMS[field]
-    
-    for potential_field in FIELD_STREAMS.keys():
-        if field.startswith(potential_field):
-            return "field/" + FIELD_STREAMS[potential_field]
-    
+    stream = _FIELD_EXACT.get(field.lower())
+    if stream:
+        return "field/" + stream
+
+    # Fields sometimes carry a suffix, e.g. "Macroeconomics and Monetary Policy";
+    # the first word narrows the candidates to at most one full prefix to verify
+    match = _FIELD_BY_FIRST_WORD.get(field.split(" ", 1)[0].lower())
+    if match:
+        prefix, stream = match
+        if field.startswith(prefix):
+            return "field/" + stream
+
     return None
 
 def _website_fields_to_streams(fields):
@@ -105,35 +212,31 @@ def _website_fields_to_streams(fields):
     return streams
 
 
-def welcome_new_user(client, template: jinja2.Template, students: List[GradStudent], user_id: int, name: str, email: str):
-    resp = client.get_streams()
-    if resp["result"] != "success":
-        raise ZulipError(f"cannot get streams: {resp['msg']}")
-
-    all_streams = [stream["name"] for stream in resp["streams"]]
-
-    course_streams = [ stream for stream in all_streams if stream.startswith("course/")]
-    field_streams = [ stream for stream in all_streams if stream.startswith("field/")]
+def welcome_new_user(client, index: StudentIndex, user_id: int, name: str, email: str):
+    course_streams, field_streams = _get_stream_lists(client)
 
     # Streams that the user will be automatically added to
     auto_streams = []
 
     # Try and find user on the department website
-    student = _find_grad_student(students, name, email)
+    student = _find_grad_student(index, name, email)
     if student:
         if student.year == 1:
             auto_streams.extend(FIRST_YEAR_COURSES_STREAMS)
         else:
             auto_streams.extend(_website_fields_to_streams(student.fields))
 
-    # Try and register the user to their field and course streams
-    resp = client.add_subscriptions(
-        streams=[{"name": stream} for stream in auto_streams],
-        principals=[user_id],
-    )
+    # Try and register the user to their field and course streams. All the streams
+    # go in a single add_subscriptions call, and the call is skipped entirely when
+    # there is nothing to subscribe to.
+    if auto_streams:
+        resp = client.add_subscriptions(
+            streams=[{"name": stream} for stream in auto_streams],
+            principals=[user_id],
+        )
 
-    if resp["result"] != "success":
-        raise ZulipError(f"cannot register user to streams: {resp['msg']}")
+        if resp["result"] != "success":
+            raise ZulipError(f"cannot register user to streams: {resp['msg']}")
 
     welcome = template.render(
         name=name, 
@@ -158,61 +261,98 @@ def _stream_filter(value):
     return f"#**{value}**"
 
 
-def _find_grad_student(students: List[GradStudent], name: str, email: str) -> Optional[GradStudent]:
+# The welcome template is compiled once at import time; the Environment caches the
+# compiled template so every render reuses it. The bot is long-running, so disable
+# auto-reload (no stat() per render) and keep compiled bytecode on disk so restarts
+# skip the parse/compile step too.
+_BYTECODE_CACHE_DIR = "/tmp/zulip-welcome-bot-jinja"
+os.makedirs(_BYTECODE_CACHE_DIR, exist_ok=True)
+
+_env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.dirname(os.path.realpath(__file__))),
+    autoescape=True,
+    auto_reload=False,
+    bytecode_cache=jinja2.FileSystemBytecodeCache(directory=_BYTECODE_CACHE_DIR),
+)
+_env.filters["format_stream"] = _stream_filter
+
+template = _env.get_template("welcome.md.jinja2")
+
+
+def _find_grad_student(index: StudentIndex, name: str, email: str) -> Optional[GradStudent]:
+    email = email.lower()
+
     # Try first with the NU email
-    for student in students:
-        if student.email == email.lower():
-            return student
-    
+    student = index.by_email.get(email)
+    if student:
+        return student
+
     # A common pattern is removing the year suffix from the email address
     # Given an email address with the year suffix, try and generate this
-    m = re.match(r"^([a-zA-Z]+)\d{4}@([a-z\.]+)$", email.lower())
+    m = _EMAIL_YEAR_RE.match(email)
     if m:
         first_part, domain = m.groups()
-        new_email = f"{first_part}@{domain}"
-        
-        for student in students:
-            if student.email == new_email:
-                return student
-    
-    # Else try to match by name
-    for student in students:
-        if student.name.lower() == name.lower():
+        student = index.by_email.get(f"{first_part}@{domain}")
+        if student:
             return student
-    
-    return None
 
+    # Else try to match by name
+    return index.by_name.get(name.lower())
+
+
+def _get_welcomed_user_ids(client: zulip.Client) -> set:
+    # One query for every direct message the bot has ever sent is far cheaper than
+    # a "has this user been DMed?" round trip per member
+    narrow = [{"operator": "sender", "operand": client.email}, {"operator": "is", "operand": "dm"}]
+    request = {"anchor": "newest", "num_after": 0, "num_before": 5000, "narrow": narrow}
+
+    resp = client.get_messages(request)
+    if resp["result"] != "success":
+        raise ZulipError(f"cannot get messages: {resp['msg']}")
+
+    return {
+        recipient["id"]
+        for message in resp["messages"]
+        for recipient in message["display_recipient"]
+    }
+
+
+def send_missing_welcome_messages(client: zulip.Client, index: StudentIndex):
+    welcomed_user_ids = _get_welcomed_user_ids(client)
 
-def send_missing_welcome_messages(client: zulip.Client, template: jinja2.Template, students: List[GradStudent]):
     resp = client.get_members()
     if resp["result"] != "success":
         raise ZulipError(f"cannot get members: {resp['msg']}")
 
-    for member in resp["members"]:
-        if member["is_bot"] or not member["is_active"]:
-            continue
+    missing_members = [
+        member
+        for member in resp["members"]
+        if not member["is_bot"] and member["is_active"] and member["user_id"] not in welcomed_user_ids
+    ]
 
-        user_id = member["user_id"]
-        narrow = [{"operator": "dm", "operand": [user_id]}]
+    if not missing_members:
+        return
 
-        request = {"anchor": "newest", "num_after": 0, "num_before": 100, "narrow": narrow}
-        resp = client.get_messages(request)
-        if resp["result"] != "success":
-            raise ZulipError(f"cannot get messages: {resp['msg']}")
+    # Warm the stream list cache on this thread so the workers do not race to fill it
+    _get_stream_lists(client)
 
-        if not resp["messages"]:
-            user_id = member["user_id"]
-            name = member["full_name"]
-            nu_email = member["delivery_email"]  # the actual email address used to register
-            try:
-                welcome_new_user(client, template, students, user_id, name, nu_email)
-                print(f"Sent belated welcome message to {nu_email}")
-            except Exception as e:
-                print(e, file=sys.stderr)
+    def _welcome(member: Dict[str, Any]):
+        nu_email = member["delivery_email"]  # the actual email address used to register
+        try:
+            welcome_new_user(client, index, member["user_id"], member["full_name"], nu_email)
+            print(f"Sent belated welcome message to {nu_email}")
+        except Exception as e:
+            print(e, file=sys.stderr)
+
+    # Each welcome is a couple of independent Zulip API calls, so fan them out over
+    # a thread pool rather than paying the round trips serially
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for _ in executor.map(_welcome, missing_members):
+            pass
 
 
 if __name__ == "__main__":
-    students = scrape_grad_students()
+    index = index_students(scrape_grad_students())
     config_file = os.getenv("ZULIPRC")
     if config_file is None:
         print("error: could not find configuration file", file=sys.stderr)
@@ -220,14 +360,6 @@ if __name__ == "__main__":
 
     client = zulip.Client(config_file=config_file)
 
-    env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(os.path.dirname(os.path.realpath(__file__))),
-        autoescape=True,
-    )
-    env.filters["format_stream"] = _stream_filter
-
-    template = env.get_template("welcome.md.jinja2")
-
     def handle_event(event: Dict[str, Any]) -> None:
         if event["type"] == "realm_user" and event["op"] == "add":
             person = event["person"]
@@ -240,11 +372,11 @@ if __name__ == "__main__":
             nu_email = person["delivery_email"]  # the actual email address used to register
 
             try:
-                welcome_new_user(client, template, students, user_id, name, nu_email)
+                welcome_new_user(client, index, user_id, name, nu_email)
                 print(f"Registered {nu_email}")
             except Exception as e:
                 print(e, file=sys.stderr)
 
-    send_missing_welcome_messages(client, template, students)
+    send_missing_welcome_messages(client, index)
     client.call_on_each_event(handle_event, event_types=["realm_user"])
     
\ No newline at end of file
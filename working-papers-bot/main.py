@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 
 import argparse
+import html
 import os
+import re
 import sys
-import time
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urldefrag, urljoin
 from typing import Iterator, NamedTuple, Optional, Any
 
@@ -12,10 +14,11 @@ import jinja2
 import requests
 import zulip
 
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 TIMEOUT = 5
-SLEEP_TIME = 0.1
+MAX_WORKERS = 4
 TOPIC = "working papers"
 
 STREAM_SEARCH_TERMS: dict[str, list[tuple[str, str]]] = {
@@ -114,6 +117,24 @@ class Author(NamedTuple):
     url: Optional[str]
 
 
+# The author strings from the API are tiny snippets with at most one anchor, so a
+# pair of regexes extracts them without spinning up an HTML parser per author
+_AUTHOR_ANCHOR_RE = re.compile(r'<a[^>]+href="([^"]+)"[^>]*>', re.IGNORECASE)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def _parse_author(raw_author: str) -> Author:
+    name = html.unescape(_TAG_RE.sub("", raw_author)).strip()
+
+    m = _AUTHOR_ANCHOR_RE.search(raw_author)
+    if m:
+        author_url = _fix_url(html.unescape(m.group(1)))
+    else:
+        author_url = None
+
+    return Author(name=name, url=author_url)
+
+
 class WorkingPaper(NamedTuple):
     url: str
     title: str
@@ -121,13 +142,36 @@ class WorkingPaper(NamedTuple):
     abstract: str
 
 
+# The template never changes at runtime, so skip auto-reload stat()s and cache the
+# compiled bytecode on disk so repeated runs skip the parse/compile step.
+_BYTECODE_CACHE_DIR = "/tmp/zulip-working-papers-bot-jinja"
+os.makedirs(_BYTECODE_CACHE_DIR, exist_ok=True)
+
 _env = jinja2.Environment(
     loader=jinja2.FileSystemLoader(os.path.dirname(os.path.realpath(__file__))),
     autoescape=True,
+    auto_reload=False,
+    bytecode_cache=jinja2.FileSystemBytecodeCache(directory=_BYTECODE_CACHE_DIR),
 )
 
 template = _env.get_template("digest.md.jinja2")
 
+# All requests go to www.nber.org, so share one Session for the whole run: connections
+# are kept alive and reused rather than paying a TCP + TLS handshake per search term.
+_session = requests.Session()
+_session.headers.update({
+    "User-Agent": "nu-econ-zulip-bots (https://github.com/james-atkins/zulip-nu-econ)",
+    "Accept": "application/json",
+})
+_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]),
+    ),
+)
+
 
 def _fix_url(url: str) -> str:
     defragged, _ = urldefrag(url)
@@ -138,7 +182,7 @@ def _fix_url(url: str) -> str:
         return defragged
         
 
-def get_new_working_papers(session: requests.Session, facet: str, term: str) -> Iterator[WorkingPaper]:
+def get_new_working_papers(facet: str, term: str) -> Iterator[WorkingPaper]:
     url = "https://www.nber.org/api/v1/working_page_listing/contentType/working_paper/_/_/search"
     params = {
         "facet": f"{facet}:{term}",
@@ -146,7 +190,7 @@ def get_new_working_papers(session: requests.Session, facet: str, term: str) ->
         "perPage": str(50),
         "sortBy": "public_date",
     }
-    resp = session.get(url, params=params, timeout=TIMEOUT)
+    resp = _session.get(url, params=params, timeout=TIMEOUT)
     resp.raise_for_status()
 
     data = resp.json()
@@ -163,34 +207,43 @@ def get_new_working_papers(session: requests.Session, facet: str, term: str) ->
         abstract = result["abstract"]
         raw_authors = result["authors"]
 
-        authors = []
-        for raw_author in raw_authors:
-            soup = BeautifulSoup(raw_author, features="lxml")
-            name = soup.text
-            a = soup.find("a")
-            if a:
-                author_url = _fix_url(a["href"])
-            else:
-                author_url = None
-
-            authors.append(Author(name=name, url=author_url))
-
         yield WorkingPaper(
             url=url,
             title=title,
-            authors=tuple(authors),
+            authors=tuple(_parse_author(raw_author) for raw_author in raw_authors),
             abstract=abstract,
         )
 
 
-def make_messages(session: requests.Session) -> Iterator[dict[str, Any]]:
+def _fetch_working_papers(facet: str, term: str) -> list[WorkingPaper]:
+    return list(get_new_working_papers(facet, term))
+
+
+def make_messages() -> Iterator[dict[str, Any]]:
+    # Some search terms are shared between streams, so fetch each unique
+    # (facet, term) pair exactly once and then bucket the results per stream.
+    # The searches are independent I/O-bound requests to the same host, so fan them
+    # out over a small thread pool sharing the pooled Session. The pool size also
+    # bounds how hard we hit the NBER API.
+    unique_terms = {
+        search_term
+        for search_terms in STREAM_SEARCH_TERMS.values()
+        for search_term in search_terms
+    }
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(_fetch_working_papers, facet, term): (facet, term)
+            for facet, term in unique_terms
+        }
+
+        papers_per_term = {futures[future]: future.result() for future in as_completed(futures)}
+
     for stream, search_terms in STREAM_SEARCH_TERMS.items():
         working_papers: dict[str, WorkingPaper] = {}
-
-        for facet, term in search_terms:
-            for working_paper in get_new_working_papers(session, facet, term):
+        for search_term in search_terms:
+            for working_paper in papers_per_term[search_term]:
                 working_papers[working_paper.url] = working_paper
-            time.sleep(SLEEP_TIME)
 
         if not working_papers:
             continue
@@ -225,17 +278,23 @@ if __name__ == "__main__":
 
     client = zulip.Client(config_file=config_file)
 
-    with requests.Session() as session:
-        messages = list(make_messages(session))
+    messages = list(make_messages())
 
-        if args.dry_run:
-            for message in messages:
-                print_message(message)
-        else:
-            for message in messages:
-                result = client.send_message(message)
-
-                if result["result"] != "success":
-                    print(f"could not send message to {message['to']}: {result['msg']}", file=sys.stderr)
-                    sys.exit(1)
+    if args.dry_run:
+        for message in messages:
+            print_message(message)
+    else:
+        # Each message is an independent POST to the same host, so send them
+        # concurrently over the client's keep-alive connections
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = list(executor.map(client.send_message, messages))
+
+        failed = False
+        for message, result in zip(messages, results):
+            if result["result"] != "success":
+                print(f"could not send message to {message['to']}: {result['msg']}", file=sys.stderr)
+                failed = True
+
+        if failed:
+            sys.exit(1)
 